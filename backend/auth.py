@@ -1,16 +1,33 @@
+import asyncio
+import hashlib
 import httpx
+import math
 import os
+import random
+import time
 from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Optional
+import jwt
+from jwt import InvalidTokenError
+from cachetools import TTLCache
 from fastapi import HTTPException, status
-from dotenv import load_dotenv
-
-load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24時間
+ACCESS_TOKEN_EXPIRES = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+ACCESS_TOKEN_MAX_AGE = ACCESS_TOKEN_EXPIRE_MINUTES * 60  # クッキーの有効期限（秒）
+
+# イシュー一括作成時の同時実行数
+ISSUE_CREATION_CONCURRENCY = 10
+
+# GitHub APIのリトライ設定
+GITHUB_MAX_RETRIES = 5
+GITHUB_MAX_RATE_LIMIT_WAIT = 60  # これ以上待つ必要がある場合はリトライしない（秒）
+
+# リポジトリ一覧の1ページあたりの件数（GitHub APIの上限）
+REPOSITORIES_PER_PAGE = 100
 
 GITHUB_CLIENT_ID = os.getenv("GITHUB_CLIENT_ID")
 GITHUB_CLIENT_SECRET = os.getenv("GITHUB_CLIENT_SECRET")
@@ -18,100 +35,227 @@ GITHUB_CLIENT_SECRET = os.getenv("GITHUB_CLIENT_SECRET")
 if not all([SECRET_KEY, GITHUB_CLIENT_ID, GITHUB_CLIENT_SECRET]):
     raise ValueError("Required environment variables are not set")
 
-async def exchange_code_for_token(code: str) -> str:
-    """GitHubの認証コードをアクセストークンに交換"""
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://github.com/login/oauth/access_token",
-            data={
-                "client_id": GITHUB_CLIENT_ID,
-                "client_secret": GITHUB_CLIENT_SECRET,
-                "code": code,
-            },
-            headers={"Accept": "application/json"}
-        )
+# GitHub API呼び出し用の共有HTTPクライアント（アプリ全体で接続をプールして再利用する）
+# OAuthのトークン交換（github.com）のみ絶対URLで呼び出す
+http_client = httpx.AsyncClient(
+    base_url="https://api.github.com",
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,  # 並行リクエストを1本の接続に多重化
+        retries=3,  # 接続エラー時のリトライ
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+    ),
+    timeout=10.0,
+    headers={"Accept": "application/vnd.github+json"},
+)
+
+# 検証済みJWTのキャッシュ（同じトークンの再検証を省略する）
+# キーには生のトークンではなくSHA-256ダイジェストを使う
+_verified_token_cache = TTLCache(maxsize=10_000, ttl=3600)
+
+async def close_http_client():
+    """共有HTTPクライアントをクローズ"""
+    await http_client.aclose()
+
+def _parse_retry_after(value: str) -> Optional[float]:
+    """Retry-Afterヘッダー（秒数またはHTTP日付）を待機秒数に変換（解釈できない場合はNone）"""
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = None
+    if seconds is not None:
+        return max(seconds, 0) if math.isfinite(seconds) else None
+    
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0)
+
+def _parse_ratelimit_reset(value: Optional[str]) -> Optional[float]:
+    """x-ratelimit-resetヘッダー（UNIX時刻）を待機秒数に変換（解釈できない場合はNone）"""
+    try:
+        reset_at = float(value)
+    except (TypeError, ValueError):
+        return None
+    return max(reset_at - time.time(), 0) if math.isfinite(reset_at) else None
+
+def _get_retry_delay(method: str, response: httpx.Response, attempt: int) -> Optional[float]:
+    """リトライまでの待機秒数を返す（リトライしない場合はNone）"""
+    backoff = random.uniform(0, 2 ** attempt)
+    
+    if response.status_code in (403, 429):
+        # レート制限以外の403（権限不足など）はリトライしない
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            wait = _parse_retry_after(retry_after)
+        elif response.headers.get("x-ratelimit-remaining") == "0":
+            wait = _parse_ratelimit_reset(response.headers.get("x-ratelimit-reset"))
+        else:
+            return None
         
-        if response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Failed to exchange code for token")
+        # ヘッダーの値を解釈できない場合は通常のバックオフで待つ
+        if wait is None:
+            return backoff
+        return wait + backoff if wait <= GITHUB_MAX_RATE_LIMIT_WAIT else None
+    
+    # 一時的なサーバーエラーは冪等なGETのみリトライ
+    if response.status_code in (502, 503, 504) and method == "GET":
+        return backoff
+    
+    return None
+
+async def _gh_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """GitHubへリクエストを送信（レート制限・一時的なエラー時は指数バックオフでリトライ）"""
+    for attempt in range(GITHUB_MAX_RETRIES + 1):
+        response = await http_client.request(method, url, **kwargs)
         
-        data = response.json()
-        access_token = data.get("access_token")
+        delay = _get_retry_delay(method, response, attempt)
+        if delay is None or attempt == GITHUB_MAX_RETRIES:
+            break
+        await asyncio.sleep(delay)
+    
+    return response
+
+async def exchange_code_for_token(code: str) -> str:
+    """GitHubの認証コードをアクセストークンに交換"""
+    response = await _gh_request(
+        "POST",
+        "https://github.com/login/oauth/access_token",
+        data={
+            "client_id": GITHUB_CLIENT_ID,
+            "client_secret": GITHUB_CLIENT_SECRET,
+            "code": code,
+        },
+        headers={"Accept": "application/json"}
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(status_code=400, detail="Failed to exchange code for token")
+    
+    data = response.json()
+    access_token = data.get("access_token")
+    
+    if not access_token:
+        raise HTTPException(status_code=400, detail="No access token received")
         
-        if not access_token:
-            raise HTTPException(status_code=400, detail="No access token received")
-            
-        return access_token
+    return access_token
 
 async def get_github_user(access_token: str) -> dict:
     """GitHubのアクセストークンを使ってユーザー情報を取得"""
-    async with httpx.AsyncClient() as client:
-        # ユーザー基本情報を取得
-        response = await client.get(
-            "https://api.github.com/user",
-            headers={"Authorization": f"token {access_token}"}
-        )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Failed to get user info")
-        
-        user_data = response.json()
-        
-        # メールアドレスを取得
-        try:
-            email_response = await client.get(
-                "https://api.github.com/user/emails",
-                headers={"Authorization": f"token {access_token}"}
-            )
-            
-            if email_response.status_code == 200:
-                emails = email_response.json()
-                primary_email = next((email["email"] for email in emails if email["primary"]), None)
-                if primary_email and not user_data.get("email"):
-                    user_data["email"] = primary_email
-        except:
-            pass  # メール取得に失敗しても続行
-        
-        return user_data
+    headers = {"Authorization": f"token {access_token}"}
+    
+    # ユーザー基本情報とメールアドレスを並行して取得
+    response, email_response = await asyncio.gather(
+        _gh_request("GET", "/user", headers=headers),
+        _gh_request("GET", "/user/emails", headers=headers),
+        return_exceptions=True
+    )
+    
+    if isinstance(response, Exception) or response.status_code != 200:
+        raise HTTPException(status_code=400, detail="Failed to get user info")
+    
+    user_data = response.json()
+    
+    # メールアドレスを反映
+    try:
+        if not isinstance(email_response, Exception) and email_response.status_code == 200:
+            emails = email_response.json()
+            primary_email = next((email["email"] for email in emails if email["primary"]), None)
+            if primary_email and not user_data.get("email"):
+                user_data["email"] = primary_email
+    except:
+        pass  # メール取得に失敗しても続行
+    
+    return user_data
+
+async def stream_user_repositories(access_token: str) -> AsyncIterator[list]:
+    """ユーザーのリポジトリ一覧をページ単位で順に返す"""
+    url = "/user/repos"
+    headers = {"Authorization": f"token {access_token}"}
+    params = {
+        "sort": "updated",
+        "per_page": REPOSITORIES_PER_PAGE,
+        "type": "owner"  # 自分が所有するリポジトリのみ
+    }
+    
+    response = await _gh_request("GET", url, headers=headers, params={**params, "page": 1})
+    
+    if response.status_code != 200:
+        raise HTTPException(status_code=400, detail="Failed to get repositories")
+    
+    yield response.json()
+    
+    # Linkヘッダーから最終ページを求め、残りのページを並行して取得（返すのはページ順）
+    last_link = response.links.get("last")
+    if not last_link:
+        return
+    
+    last_page = int(httpx.URL(last_link["url"]).params.get("page", 1))
+    tasks = [
+        asyncio.create_task(_gh_request("GET", url, headers=headers, params={**params, "page": page}))
+        for page in range(2, last_page + 1)
+    ]
+    
+    try:
+        for task in tasks:
+            page_response = await task
+            if page_response.status_code != 200:
+                raise HTTPException(status_code=400, detail="Failed to get repositories")
+            yield page_response.json()
+    finally:
+        # 途中で打ち切られた場合は未完了のリクエストを取り消す
+        for task in tasks:
+            task.cancel()
+        # 完了済みのタスクの例外も回収し、未回収の警告が出ないようにする
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 async def get_user_repositories(access_token: str) -> list:
-    """ユーザーのリポジトリ一覧を取得"""
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            "https://api.github.com/user/repos",
-            headers={"Authorization": f"token {access_token}"},
-            params={
-                "sort": "updated",
-                "per_page": 50,
-                "type": "owner"  # 自分が所有するリポジトリのみ
-            }
-        )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Failed to get repositories")
-        
-        return response.json()
+    """ユーザーのリポジトリ一覧を取得（全ページ）"""
+    repositories = []
+    async for page in stream_user_repositories(access_token):
+        repositories.extend(page)
+    return repositories
 
 async def create_github_issue(access_token: str, repository: str, title: str, body: str, labels: list = None) -> dict:
     """GitHubにイシューを作成"""
-    async with httpx.AsyncClient() as client:
-        issue_data = {
-            "title": title,
-            "body": body
-        }
-        
-        if labels:
-            issue_data["labels"] = labels
-        
-        response = await client.post(
-            f"https://api.github.com/repos/{repository}/issues",
-            headers={"Authorization": f"token {access_token}"},
-            json=issue_data
-        )
-        
-        if response.status_code != 201:
-            raise HTTPException(status_code=400, detail=f"Failed to create issue: {response.text}")
-        
-        return response.json()
+    issue_data = {
+        "title": title,
+        "body": body
+    }
+    
+    if labels:
+        issue_data["labels"] = labels
+    
+    response = await _gh_request(
+        "POST",
+        f"/repos/{repository}/issues",
+        headers={"Authorization": f"token {access_token}"},
+        json=issue_data
+    )
+    
+    if response.status_code != 201:
+        raise HTTPException(status_code=400, detail=f"Failed to create issue: {response.text}")
+    
+    return response.json()
+
+async def create_github_issues_bulk(access_token: str, repository: str, issues: list) -> list:
+    """複数のイシューを同時実行数を制限しつつ並行して作成
+    
+    結果はissuesと同じ順序で、作成に失敗したものは例外オブジェクトになる
+    """
+    semaphore = asyncio.Semaphore(ISSUE_CREATION_CONCURRENCY)
+    
+    async def create_one(issue: dict) -> dict:
+        async with semaphore:
+            return await create_github_issue(
+                access_token,
+                repository,
+                issue["title"],
+                issue["body"],
+                issue.get("labels")
+            )
+    
+    return await asyncio.gather(*[create_one(issue) for issue in issues], return_exceptions=True)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """JWTアクセストークンを作成"""
@@ -119,18 +263,26 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = datetime.utcnow() + ACCESS_TOKEN_EXPIRES
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 def verify_token(token: str) -> dict:
     """JWTトークンを検証"""
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    cache_key = hashlib.sha256(token.encode()).digest()
+    payload = _verified_token_cache.get(cache_key)
+    if payload is not None and payload["exp"] > time.time():
         return payload
-    except JWTError:
+    
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp", "sub"]})
+    except InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
-        )
\ No newline at end of file
+        )
+    
+    # 検証に成功したトークンのみキャッシュする
+    _verified_token_cache[cache_key] = payload
+    return payload
@@ -1,12 +1,29 @@
 import os
-import json
+import asyncio
+import logging
+import hashlib
+import orjson
+from itertools import islice
+from contextlib import nullcontext
 from typing import List, Dict, Any
-from openai import OpenAI
-from dotenv import load_dotenv
+from openai import AsyncOpenAI
+from pydantic import BaseModel, ValidationError, field_validator
+from cachetools import TTLCache
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# 使用モデルと最大トークン数（環境変数で切り替え可能）
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5-chat-latest")
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS")) if os.getenv("OPENAI_MAX_TOKENS") else None
+
+# 1回の生成で返すイシューの最大数
+MAX_ISSUES = 20
+
+# 同じマークダウンに対する生成結果のキャッシュ（LLM_CACHE_ENABLED=trueで有効）
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+_llm_cache = TTLCache(maxsize=256, ttl=3600)
 
 ISSUE_GENERATION_PROMPT = """
 あなたは経験豊富なソフトウェアエンジニア・テックリードです。
@@ -33,16 +50,16 @@ ISSUE_GENERATION_PROMPT = """
 - ✅ 良い例: "JWT認証ミドルウェアの実装"、"ログイン画面のUI作成"、"認証API のテスト作成"
 
 ## JSON出力形式:
-{{
+{
   "issues": [
-    {{
+    {
       "title": "🎨 フロントエンド: ログインフォームコンポーネント実装",
       "body": "## 概要\\nログイン機能のフロントエンドコンポーネントを実装する\\n\\n## 技術詳細\\n- React + TypeScript\\n- フォームバリデーション (react-hook-form)\\n- Tailwind CSS でスタイリング\\n\\n## 実装内容\\n- メールアドレス・パスワード入力フィールド\\n- クライアントサイドバリデーション\\n- ローディング状態管理\\n- エラーメッセージ表示\\n\\n## 受け入れ条件\\n- [ ] 必須項目のバリデーションが動作する\\n- [ ] API呼び出し中はボタンが無効化される\\n- [ ] エラーレスポンスを適切に表示する\\n- [ ] レスポンシブ対応（モバイル・デスクトップ）\\n- [ ] アクセシビリティ要件を満たす（ARIA属性）\\n\\n## 実装ファイル\\n- `components/auth/LoginForm.tsx`\\n- `components/auth/LoginForm.test.tsx`\\n- `hooks/useAuth.ts`\\n\\n## 依存関係\\n- 前提: API認証エンドポイント実装完了\\n- 並行可能: パスワードリセット画面",
       "labels": ["frontend", "component", "auth", "priority-high"],
       "priority": 1
-    }}
+    }
   ]
-}}
+}
 
 ## 分解対象の要件定義:
 {markdown_content}
@@ -55,212 +72,273 @@ ISSUE_GENERATION_PROMPT = """
 - JSON形式のみで回答し、説明文は含めないでください
 """
 
-def validate_issue(issue: Any, index: int) -> Dict[str, Any] | None:
-    """単一のイシューをバリデーション"""
+# str.formatを使わず連結できるよう、プロンプトを入力箇所の前後に分割しておく
+_PROMPT_PREFIX, _PROMPT_SUFFIX = ISSUE_GENERATION_PROMPT.split("{markdown_content}")
+
+def _coerce_priority(priority: Any) -> int:
+    """優先度を1-5の整数に変換（変換できない場合は3）"""
     try:
-        if not isinstance(issue, dict):
-            print(f"Issue {index}: Not a dictionary, got {type(issue)}")
-            return None
-        
-        # タイトルのバリデーション
-        title = issue.get("title")
+        return max(1, min(5, int(priority)))
+    except (TypeError, ValueError):
+        return 3
+
+class GeneratedIssue(BaseModel):
+    """LLMが生成した単一のイシュー"""
+    title: str
+    body: str = ""
+    labels: List[str] = []
+    priority: int = 3
+    
+    @field_validator("title", mode="before")
+    @classmethod
+    def validate_title(cls, title: Any) -> str:
         if not isinstance(title, str) or not title.strip():
-            print(f"Issue {index}: Invalid title: {repr(title)}")
-            return None
+            raise ValueError(f"Invalid title: {title!r}")
         
         # 長すぎるタイトルを切り詰める
         if len(title) > 200:
             title = title[:197] + "..."
-        
-        # 本文のバリデーション
-        body = issue.get("body", "")
+        return title.strip()
+    
+    @field_validator("body", mode="before")
+    @classmethod
+    def validate_body(cls, body: Any) -> str:
         if not isinstance(body, str):
             body = str(body) if body else "No description provided"
-        
-        # ラベルのバリデーション
-        labels = issue.get("labels", [])
+        return body
+    
+    @field_validator("labels", mode="before")
+    @classmethod
+    def validate_labels(cls, labels: Any) -> List[str]:
+        # 文字列のラベルのみを保持
         if not isinstance(labels, list):
-            labels = []
-        else:
-            # 文字列のラベルのみを保持
-            labels = [str(label) for label in labels if isinstance(label, str) and label.strip()]
-        
-        # 優先度のバリデーション
-        priority = issue.get("priority", 3)
-        if not isinstance(priority, int):
-            try:
-                priority = int(priority)
-            except (ValueError, TypeError):
-                priority = 3
-        
-        # 優先度を1-5の範囲に制限
-        priority = max(1, min(5, priority))
-        
-        validated = {
-            "title": title.strip(),
-            "body": body,
-            "labels": labels,
-            "priority": priority
-        }
-        
-        print(f"Issue {index} validated successfully: {validated['title']}")
-        return validated
-        
-    except Exception as e:
-        print(f"Error validating issue {index}: {e}")
+            return []
+        return [label.strip() for label in labels if isinstance(label, str) and label.strip()]
+    
+    @field_validator("priority", mode="before")
+    @classmethod
+    def validate_priority(cls, priority: Any) -> int:
+        return _coerce_priority(priority)
+
+def validate_issue(issue: Any, index: int) -> Dict[str, Any] | None:
+    """単一のイシューをバリデーション"""
+    if not isinstance(issue, dict):
+        logger.warning("Issue %d: Not a dictionary, got %s", index, type(issue))
+        return None
+    
+    try:
+        validated = GeneratedIssue.model_validate(issue).model_dump()
+    except ValidationError as e:
+        logger.warning("Error validating issue %d: %s", index, e)
         return None
+    
+    logger.debug("Issue %d validated successfully: %s", index, validated["title"])
+    return validated
 
 def validate_issues_response(data: Any) -> List[Dict[str, Any]]:
     """イシューレスポンス全体をバリデーション"""
     try:
-        print(f"Validating response data type: {type(data)}")
+        logger.debug("Validating response data type: %s", type(data))
         
         if not isinstance(data, dict):
-            print(f"Response is not a dictionary, got: {type(data)}")
-            print(f"Response content: {repr(data)}")
+            logger.warning("Response is not a dictionary, got: %s", type(data))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Response content: %r", data)
             return []
         
-        print(f"Response keys: {list(data.keys())}")
+        logger.debug("Response keys: %s", list(data.keys()))
         
         if "issues" not in data:
-            print("No 'issues' key found in response")
-            print(f"Available keys: {list(data.keys())}")
+            logger.warning("No 'issues' key found in response. Available keys: %s", list(data.keys()))
             return []
         
         issues = data["issues"]
-        print(f"Issues type: {type(issues)}, length: {len(issues) if isinstance(issues, list) else 'N/A'}")
         
         if not isinstance(issues, list):
-            print(f"'issues' is not a list, got: {type(issues)}")
+            logger.warning("'issues' is not a list, got: %s", type(issues))
             return []
         
         if len(issues) == 0:
-            print("No issues found in response")
+            logger.warning("No issues found in response")
             return []
         
-        if len(issues) > 20:
-            print(f"Too many issues ({len(issues)}), limiting to 20")
-            issues = issues[:20]
+        if len(issues) > MAX_ISSUES:
+            logger.info("Too many issues (%d), limiting to %d", len(issues), MAX_ISSUES)
         
+        # 先頭からMAX_ISSUES件だけを、リストをコピーせずに順次バリデーション
         validated_issues = []
-        for i, issue in enumerate(issues):
-            print(f"Validating issue {i}: {type(issue)}")
+        for i, issue in enumerate(islice(issues, MAX_ISSUES)):
             validated_issue = validate_issue(issue, i)
             if validated_issue:
                 validated_issues.append(validated_issue)
             else:
-                print(f"Skipping invalid issue at index {i}")
+                logger.info("Skipping invalid issue at index %d", i)
         
-        print(f"Successfully validated {len(validated_issues)} out of {len(issues)} issues")
+        logger.info("Successfully validated %d out of %d issues", len(validated_issues), min(len(issues), MAX_ISSUES))
         return validated_issues
         
     except Exception as e:
-        print(f"Error in validate_issues_response: {e}")
+        logger.exception("Error in validate_issues_response: %s", e)
         return []
 
-async def generate_issues_from_markdown(markdown_content: str) -> List[Dict]:
-    """マークダウンからイシューを生成（JSON mode + 手動バリデーション）"""
+class JsonObjectTracker:
+    """ストリーミング中のJSONテキストでトップレベルのオブジェクトが閉じたかを追跡"""
     
-    print("=" * 60)
-    print("GENERATE ISSUES DEBUG START")
-    print(f"Input markdown length: {len(markdown_content)} characters")
-    print(f"First 300 characters: {repr(markdown_content[:300])}")
-    print(f"OpenAI API Key set: {bool(os.getenv('OPENAI_API_KEY'))}")
-    print("=" * 60)
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+    
+    def feed(self, chunk: str) -> int | None:
+        """チャンクを読み込み、トップレベルのオブジェクトが閉じた位置を返す（未完了ならNone）"""
+        for position, char in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    return position
+        return None
+
+async def read_json_stream(stream) -> str:
+    """OpenAIのストリームからJSONを受信し、オブジェクトが閉じた時点で打ち切る
+    
+    JSON modeでは閉じ括弧の後に空白が延々と続くことがあるため、
+    完了を検知したら残りのトークンを待たずに接続を閉じる
+    """
+    tracker = JsonObjectTracker()
+    chunks = []
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if not content:
+                continue
+            
+            end = tracker.feed(content)
+            if end is not None:
+                chunks.append(content[:end + 1])
+                break
+            chunks.append(content)
+    finally:
+        await stream.response.aclose()
+    
+    return "".join(chunks).strip()
+
+async def generate_issues_from_markdown(markdown_content: str, semaphore: asyncio.Semaphore | None = None) -> List[Dict]:
+    """マークダウンからイシューを生成（JSON mode + 手動バリデーション）
+    
+    semaphoreを渡すと、アプリ全体でのOpenAI呼び出しの同時実行数を制限する
+    """
+    
+    logger.info("Generating issues from markdown (%d characters)", len(markdown_content))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("First 300 characters: %r", markdown_content[:300])
+        logger.debug("OpenAI API Key set: %s", bool(os.getenv("OPENAI_API_KEY")))
     
     if not markdown_content or not markdown_content.strip():
-        print("Empty markdown content, using sample")
+        logger.info("Empty markdown content, using sample")
         markdown_content = SAMPLE_MARKDOWN
     
+    # キャッシュが無効な場合はハッシュ計算も行わない
+    cache_key = None
+    if LLM_CACHE_ENABLED:
+        cache_key = hashlib.sha256(markdown_content.encode("utf-8")).hexdigest()
+        if cache_key in _llm_cache:
+            logger.info("Returning cached issues for markdown %s", cache_key[:12])
+            return _llm_cache[cache_key]
+    
     try:
         # OpenAI API call with enhanced error handling
-        print("Making OpenAI API call...")
-        
-        response = client.chat.completions.create(
-            #model="gpt-4o-2024-11-20",
-            model="gpt-5-chat-latest",
-            messages=[
-                {
-                    "role": "user", 
-                    "content": ISSUE_GENERATION_PROMPT.format(markdown_content=markdown_content)
-                }
-            ],
-            #max_tokens=4000,
-            #temperature=0.2,
-            response_format={"type": "json_object"}  # JSON modeを有効化
-        )
+        logger.debug("Making OpenAI API call...")
         
-        print("OpenAI API call successful")
-        result_text = response.choices[0].message.content.strip()
+        # 同時に実行するOpenAI呼び出しの数を制限
+        async with semaphore or nullcontext():
+            stream = await client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[
+                    {
+                        "role": "user", 
+                        "content": _PROMPT_PREFIX + markdown_content + _PROMPT_SUFFIX
+                    }
+                ],
+                # 未設定の場合はmax_tokensを送らず、モデルの既定値に任せる
+                **({"max_tokens": OPENAI_MAX_TOKENS} if OPENAI_MAX_TOKENS else {}),
+                #temperature=0.2,
+                response_format={"type": "json_object"},  # JSON modeを有効化
+                stream=True
+            )
+            
+            result_text = await read_json_stream(stream)
         
-        print("=" * 60)
-        print("OpenAI RAW RESPONSE:")
-        print(f"Response length: {len(result_text)} characters")
-        print("Full response:")
-        print(result_text)
-        print("=" * 60)
+        logger.info("OpenAI API call successful (%d characters)", len(result_text))
+        logger.debug("OpenAI raw response:\n%s", result_text)
         
         # JSONをパース
         try:
-            print("Parsing JSON...")
-            parsed_json = json.loads(result_text)
-            print(f"JSON parsed successfully. Type: {type(parsed_json)}")
-            print(f"Parsed JSON keys: {list(parsed_json.keys()) if isinstance(parsed_json, dict) else 'Not a dict'}")
+            parsed_json = orjson.loads(result_text)
             
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing failed: {e}")
-            print(f"Failed at position: {e.pos}")
-            print(f"Raw response (first 500 chars): {repr(result_text[:500])}")
-            print("Using fallback issues")
+        except orjson.JSONDecodeError as e:
+            logger.warning("JSON parsing failed at position %d: %s. Using fallback issues", e.pos, e)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw response (first 500 chars): %r", result_text[:500])
             return get_fallback_issues()
         
         # 手動バリデーション
-        print("Starting validation...")
         validated_issues = validate_issues_response(parsed_json)
         
         if validated_issues and len(validated_issues) > 0:
-            print(f"SUCCESS: Generated {len(validated_issues)} valid issues")
-            for i, issue in enumerate(validated_issues):
-                print(f"  {i+1}. {issue['title']}")
-            print("=" * 60)
+            logger.info("Generated %d valid issues", len(validated_issues))
+            if cache_key is not None:
+                _llm_cache[cache_key] = validated_issues
+            if logger.isEnabledFor(logging.DEBUG):
+                for i, issue in enumerate(validated_issues):
+                    logger.debug("  %d. %s", i + 1, issue["title"])
             return validated_issues
         else:
-            print("FAILURE: No valid issues found after validation, using fallback")
-            print("=" * 60)
+            logger.warning("No valid issues found after validation, using fallback")
             return get_fallback_issues()
         
     except Exception as e:
-        print(f"EXCEPTION in OpenAI API call: {type(e).__name__}: {e}")
-        import traceback
-        print("Full traceback:")
-        print(traceback.format_exc())
-        print("Using fallback issues")
-        print("=" * 60)
+        logger.exception("Exception in OpenAI API call: %s: %s. Using fallback issues", type(e).__name__, e)
         return get_fallback_issues()
 
+# LLM呼び出しに失敗した場合のフォールバックイシュー（呼び出しごとに組み立て直さない）
+_FALLBACK_ISSUES = (
+    {
+        "title": "🔧 プロジェクト初期設定",
+        "body": "## 概要\nプロジェクトの初期設定を行います。\n\n## 受け入れ条件\n- [ ] 開発環境の構築\n- [ ] 基本的なプロジェクト構造の作成\n- [ ] 依存関係の設定\n\n## 実装のヒント\n既存のプロジェクトテンプレートを活用して効率的にセットアップを行ってください。",
+        "labels": ["setup", "priority-high"],
+        "priority": 1
+    },
+    {
+        "title": "📚 ドキュメント整備",
+        "body": "## 概要\nプロジェクトのドキュメントを整備します。\n\n## 受け入れ条件\n- [ ] README.mdの作成\n- [ ] API仕様書の作成\n- [ ] 開発ガイドの作成\n\n## 実装のヒント\nMarkdown形式で統一し、自動生成ツールの活用を検討してください。",
+        "labels": ["documentation", "priority-medium"],
+        "priority": 2
+    },
+    {
+        "title": "✨ 基本機能の実装",
+        "body": "## 概要\nアプリケーションの基本機能を実装します。\n\n## 受け入れ条件\n- [ ] 基本的なUI構造の作成\n- [ ] API エンドポイントの実装\n- [ ] データベース設計\n\n## 実装のヒント\nMVPアプローチで最小限の機能から始めてください。",
+        "labels": ["enhancement", "priority-high"],
+        "priority": 1
+    }
+)
+
 def get_fallback_issues() -> List[Dict]:
     """LLM呼び出しに失敗した場合のフォールバックイシュー"""
-    print("RETURNING FALLBACK ISSUES")
-    return [
-        {
-            "title": "🔧 プロジェクト初期設定",
-            "body": "## 概要\nプロジェクトの初期設定を行います。\n\n## 受け入れ条件\n- [ ] 開発環境の構築\n- [ ] 基本的なプロジェクト構造の作成\n- [ ] 依存関係の設定\n\n## 実装のヒント\n既存のプロジェクトテンプレートを活用して効率的にセットアップを行ってください。",
-            "labels": ["setup", "priority-high"],
-            "priority": 1
-        },
-        {
-            "title": "📚 ドキュメント整備",
-            "body": "## 概要\nプロジェクトのドキュメントを整備します。\n\n## 受け入れ条件\n- [ ] README.mdの作成\n- [ ] API仕様書の作成\n- [ ] 開発ガイドの作成\n\n## 実装のヒント\nMarkdown形式で統一し、自動生成ツールの活用を検討してください。",
-            "labels": ["documentation", "priority-medium"],
-            "priority": 2
-        },
-        {
-            "title": "✨ 基本機能の実装",
-            "body": "## 概要\nアプリケーションの基本機能を実装します。\n\n## 受け入れ条件\n- [ ] 基本的なUI構造の作成\n- [ ] API エンドポイントの実装\n- [ ] データベース設計\n\n## 実装のヒント\nMVPアプローチで最小限の機能から始めてください。",
-            "labels": ["enhancement", "priority-high"],
-            "priority": 1
-        }
-    ]
+    logger.info("Returning fallback issues")
+    return list(_FALLBACK_ISSUES)
 
 # サンプルマークダウン
 SAMPLE_MARKDOWN = """# ECサイト リニューアル プロジェクト
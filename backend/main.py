@@ -1,50 +1,121 @@
 import os
+import re
+import asyncio
+import logging
+import hashlib
+import orjson
 from dotenv import load_dotenv
 from pathlib import Path
-from fastapi import FastAPI, Request, HTTPException, status
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from typing import AsyncIterator
+from cachetools import TTLCache
+from fastapi import FastAPI, Request, HTTPException, Depends, status
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import timedelta
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 
+# auth・llm_serviceはインポート時に環境変数を参照するため、先に.envを読み込む
+load_dotenv()
+
 # 既存のインポート
 from auth import (
     exchange_code_for_token, 
     get_github_user, 
     create_access_token, 
     verify_token,
-    get_user_repositories,
+    stream_user_repositories,
     create_github_issue,
-    ACCESS_TOKEN_EXPIRE_MINUTES
+    create_github_issues_bulk,
+    close_http_client,
+    ACCESS_TOKEN_EXPIRES,
+    ACCESS_TOKEN_MAX_AGE,
+    REPOSITORIES_PER_PAGE
 )
 from llm_service import generate_issues_from_markdown, SAMPLE_MARKDOWN
 
-load_dotenv()
+# ログレベルは環境変数で切り替え（DEBUGでLLMの生レスポンスなどを出力）
+# LOG_LEVELはアプリのロガーのみに適用し、httpxなどのライブラリはWARNING以上のみ出力する
+logging.basicConfig(level=logging.WARNING)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+for logger_name in (__name__, "llm_service"):
+    logging.getLogger(logger_name).setLevel(LOG_LEVEL)
+logger = logging.getLogger(__name__)
 
-app = FastAPI(title="GitHub Issue Maker")
+# SPA配信用のアプリに、APIを/api配下のサブアプリとしてマウントする
+# （未定義の/api/...がindex.htmlにフォールバックせず、ルーティングもプレフィックスで分岐する）
+app = FastAPI(title="GitHub Issue Maker", docs_url=None, redoc_url=None, openapi_url=None)
+api_app = FastAPI(title="GitHub Issue Maker API", default_response_class=ORJSONResponse)
+app.mount("/api", api_app)
 
 # Railway環境判定
 IS_PRODUCTION = os.getenv("RAILWAY_ENVIRONMENT") == "production"
 
-# CORS設定
+# ユーザーごとのリポジトリ一覧（NDJSON）のキャッシュ（短時間での再取得はGitHubに問い合わせない）
+_repositories_cache = TTLCache(maxsize=2000, ttl=60)
+
+# OpenAI APIへの同時リクエスト数の上限
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+
+# CORS設定（許可するオリジンはカンマ区切りで指定）
+CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:5173").split(",")
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,  # プリフライトの結果をブラウザに1日キャッシュさせる
 )
 
+# 1KB以上のレスポンスをgzip圧縮（圧縮レベルはCPU負荷とのバランスで5）
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # 静的ファイル配信
+class HashedStaticFiles(StaticFiles):
+    """ファイル名にハッシュを含むViteのビルド成果物を長期キャッシュさせるStaticFiles
+    
+    /assetsにはViteが出力した`name-<8文字のハッシュ>.ext`形式のファイルのみが置かれる前提
+    """
+    
+    # ハッシュ部分には数字か大文字を1文字以上含むものとし、
+    # "-settings.css"のような通常の名前を長期キャッシュの対象にしない
+    # （小文字だけのハッシュは対象外になるが、通常のキャッシュ制御になるだけで安全側）
+    HASHED_NAME = re.compile(r"-(?=[A-Za-z0-9_-]{0,7}[0-9A-Z])[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+    
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        # 内容が変わればファイル名も変わるため、再検証は不要
+        if self.HASHED_NAME.search(os.path.basename(full_path)):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
 static_dir = Path(__file__).parent / "static"  # Pathオブジェクトとして定義
+INDEX_FILE = static_dir / "index.html"
+
+# index.htmlはデプロイ間で変わらないため、起動時に一度だけ読み込んでおく
+INDEX_HTML = INDEX_FILE.read_bytes() if INDEX_FILE.exists() else None
+INDEX_HEADERS = {
+    "ETag": f'"{hashlib.sha1(INDEX_HTML).hexdigest()}"',
+    "Cache-Control": "no-cache",  # 毎回ETagで再検証させる
+} if INDEX_HTML is not None else {}
+
 if static_dir.exists():
-    app.mount("/assets", StaticFiles(directory=str(static_dir / "assets")), name="assets")
-    print(f"Static files mounted from: {static_dir}")
+    app.mount("/assets", HashedStaticFiles(directory=str(static_dir / "assets")), name="assets")
+    logger.info("Static files mounted from: %s", static_dir)
 else:
-    print(f"Static directory not found: {static_dir}")
+    logger.warning("Static directory not found: %s", static_dir)
 
+@app.on_event("startup")
+async def startup_event():
+    """OpenAI呼び出しの同時実行数を制限するセマフォを用意"""
+    app.state.llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """GitHub API用の共有HTTPクライアントを解放"""
+    await close_http_client()
 
 class CreateIssueRequest(BaseModel):
     repository: str
@@ -52,22 +123,33 @@ class CreateIssueRequest(BaseModel):
     body: str
     labels: list[str] = []
 
+class IssueData(BaseModel):
+    title: str
+    body: str
+    labels: list[str] = []
+
+class CreateIssuesRequest(BaseModel):
+    repository: str
+    issues: list[IssueData]
+
 class GenerateIssuesRequest(BaseModel):
     markdown_content: str = ""
 
-@app.get("/api/config")
+# 内容が起動後に変わらないレスポンスは一度だけエンコードしておく
+CONFIG_RESPONSE = ORJSONResponse({"github_client_id": os.getenv("GITHUB_CLIENT_ID")})
+HEALTH_RESPONSE = ORJSONResponse({"status": "ok", "message": "Server is running"})
+
+@api_app.get("/config")
 async def get_config():
     """フロントエンド用設定"""
-    return {
-        "github_client_id": os.getenv("GITHUB_CLIENT_ID")
-    }
+    return CONFIG_RESPONSE
 
-@app.get("/api/health")
+@api_app.get("/health")
 async def health_check():
-    return {"status": "ok", "message": "Server is running"}
+    return HEALTH_RESPONSE
 
 # 認証コールバックでのクッキー設定を修正
-@app.get("/api/auth/callback")
+@api_app.get("/auth/callback")
 async def auth_callback(code: str = None, error: str = None):
     if error:
         return RedirectResponse(url=f"/?error={error}", status_code=302)
@@ -79,14 +161,13 @@ async def auth_callback(code: str = None, error: str = None):
         access_token = await exchange_code_for_token(code)
         user_data = await get_github_user(access_token)
         
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         jwt_token = create_access_token(
             data={
                 "sub": str(user_data["id"]), 
                 "github_data": user_data,
                 "github_access_token": access_token
             },
-            expires_delta=access_token_expires
+            expires_delta=ACCESS_TOKEN_EXPIRES
         )
         
         response = RedirectResponse(url="/", status_code=302)
@@ -94,7 +175,7 @@ async def auth_callback(code: str = None, error: str = None):
             key="access_token",
             value=jwt_token,
             httponly=True,
-            max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+            max_age=ACCESS_TOKEN_MAX_AGE,
             samesite="lax",
             secure=IS_PRODUCTION  # 本番ではHTTPS
         )
@@ -102,13 +183,12 @@ async def auth_callback(code: str = None, error: str = None):
         return response
         
     except Exception as e:
-        print(f"Auth error: {e}")
+        logger.error("Auth error: %s", e)
         return RedirectResponse(url=f"/?error=auth_failed", status_code=302)
 
 
-@app.get("/api/auth/me")
-async def get_current_user(request: Request):
-    """現在ログイン中のユーザー情報を取得"""
+async def get_token_payload(request: Request) -> dict:
+    """クッキーのJWTを検証してペイロードを返す（依存関数）"""
     token = request.cookies.get("access_token")
     
     if not token:
@@ -117,68 +197,109 @@ async def get_current_user(request: Request):
             detail="Not authenticated"
         )
     
-    try:
-        payload = verify_token(token)
-        return payload["github_data"]
-    except Exception as e:
-        print(f"Token verification error: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token"
-        )
+    return verify_token(token)
 
-@app.get("/api/github/repositories")
-async def get_repositories(request: Request):
-    """ユーザーのリポジトリ一覧を取得"""
-    token = request.cookies.get("access_token")
+async def get_github_token(payload: dict = Depends(get_token_payload)) -> str:
+    """JWTペイロードからGitHubアクセストークンを取り出す（依存関数）"""
+    github_token = payload.get("github_access_token")
     
-    if not token:
+    if not github_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Not authenticated"
+            detail="GitHub token not found"
         )
     
+    return github_token
+
+@api_app.get("/auth/me")
+async def get_current_user(payload: dict = Depends(get_token_payload)):
+    """現在ログイン中のユーザー情報を取得"""
+    return payload["github_data"]
+
+# NDJSONの最終行（クライアントは完了行がなければ途中で切れたとみなす）
+_NDJSON_DONE_LINE = orjson.dumps({"done": True}) + b"\n"
+_NDJSON_ERROR_LINE = orjson.dumps({"error": "Failed to get repositories"}) + b"\n"
+
+async def stream_repositories_ndjson(user_id: str, first_page: list, pages: AsyncIterator[list]):
+    """リポジトリを1行1件のNDJSONで送信し、すべて送り終えたらキャッシュに保存
+    
+    成功時は最後に完了行、途中のページ取得に失敗した場合はエラー行を送る
+    """
+    chunks = [b"".join(orjson.dumps(repo) + b"\n" for repo in first_page)]
+    yield chunks[0]
+    
     try:
-        payload = verify_token(token)
-        github_token = payload.get("github_access_token")
-        
-        if not github_token:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="GitHub token not found"
-            )
-        
-        repositories = await get_user_repositories(github_token)
-        return repositories
+        async for page in pages:
+            chunk = b"".join(orjson.dumps(repo) + b"\n" for repo in page)
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        logger.error("Error getting repositories: %s", e)
+        yield _NDJSON_ERROR_LINE
+        return
+    finally:
+        await pages.aclose()
+    
+    yield _NDJSON_DONE_LINE
+    chunks.append(_NDJSON_DONE_LINE)
+    cache_repositories_ndjson(user_id, b"".join(chunks))
+
+def cache_repositories_ndjson(user_id: str, content: bytes) -> str:
+    """送信し終えたNDJSONをETagとともにキャッシュし、ETagを返す"""
+    etag = f'"{hashlib.sha1(content).hexdigest()}"'
+    _repositories_cache[user_id] = (content, etag)
+    return etag
+
+@api_app.get("/github/repositories")
+async def get_repositories(
+    request: Request,
+    payload: dict = Depends(get_token_payload),
+    github_token: str = Depends(get_github_token)
+):
+    """ユーザーのリポジトリ一覧を取得（NDJSON形式）"""
+    cached = _repositories_cache.get(payload["sub"])
+    
+    if cached is not None:
+        content, etag = cached
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
         
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(content=content, media_type="application/x-ndjson", headers=headers)
+    
+    # 最初のページだけは送信前に取得し、失敗した場合はエラーレスポンスを返す
+    pages = stream_user_repositories(github_token)
+    try:
+        first_page = await anext(pages)
     except Exception as e:
-        print(f"Error getting repositories: {e}")
+        logger.error("Error getting repositories: %s", e)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Failed to get repositories"
         )
-
-@app.post("/api/github/create-issue")
-async def create_issue(request: Request, issue_request: CreateIssueRequest):
-    """GitHubイシューを作成"""
-    token = request.cookies.get("access_token")
     
-    if not token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Not authenticated"
+    # 1ページに収まる場合は続きがないため、ストリーミングせずETag付きで返す
+    if len(first_page) < REPOSITORIES_PER_PAGE:
+        await pages.aclose()
+        content = b"".join(orjson.dumps(repo) + b"\n" for repo in first_page) + _NDJSON_DONE_LINE
+        etag = cache_repositories_ndjson(payload["sub"], content)
+        return Response(
+            content=content,
+            media_type="application/x-ndjson",
+            headers={"ETag": etag, "Cache-Control": "private, no-cache"}
         )
     
+    # 複数ページの場合は送信前に本文が確定しないため、ETagは次回のキャッシュヒット時から付与する
+    return StreamingResponse(
+        stream_repositories_ndjson(payload["sub"], first_page, pages),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "private, no-cache"}
+    )
+
+@api_app.post("/github/create-issue")
+async def create_issue(issue_request: CreateIssueRequest, github_token: str = Depends(get_github_token)):
+    """GitHubイシューを作成"""
     try:
-        payload = verify_token(token)
-        github_token = payload.get("github_access_token")
-        
-        if not github_token:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="GitHub token not found"
-            )
-        
         # イシューを作成
         issue = await create_github_issue(
             github_token,
@@ -191,75 +312,111 @@ async def create_issue(request: Request, issue_request: CreateIssueRequest):
         return issue
         
     except Exception as e:
-        print(f"Error creating issue: {e}")
+        logger.error("Error creating issue: %s", e)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Failed to create issue"
         )
 
-@app.post("/api/llm/generate-issues")
-async def generate_issues(request: Request, generate_request: GenerateIssuesRequest):
-    """マークダウンからイシューを生成"""
-    token = request.cookies.get("access_token")
-    
-    if not token:
+@api_app.post("/github/create-issues")
+async def create_issues(issues_request: CreateIssuesRequest, github_token: str = Depends(get_github_token)):
+    """複数のGitHubイシューを一括作成"""
+    try:
+        results = await create_github_issues_bulk(
+            github_token,
+            issues_request.repository,
+            [
+                {"title": issue.title, "body": issue.body, "labels": issue.labels}
+                for issue in issues_request.issues
+            ]
+        )
+        
+        created = []
+        failed = []
+        for issue, result in zip(issues_request.issues, results):
+            if isinstance(result, Exception):
+                logger.error("Error creating issue '%s': %s", issue.title, result)
+                failed.append(issue.title)
+            else:
+                created.append({"title": issue.title, "html_url": result["html_url"]})
+        
+        return {"created": created, "failed": failed}
+        
+    except Exception as e:
+        logger.error("Error creating issues: %s", e)
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Not authenticated"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Failed to create issues"
         )
-    
+
+@api_app.post("/llm/generate-issues")
+async def generate_issues(generate_request: GenerateIssuesRequest, payload: dict = Depends(get_token_payload)):
+    """マークダウンからイシューを生成"""
     try:
-        verify_token(token)
-        
         # フロントエンドから受け取ったマークダウンをデバッグ出力
-        print("Received from frontend:")
-        print(f"Content length: {len(generate_request.markdown_content)}")
-        print("First 200 chars:", repr(generate_request.markdown_content[:200]))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Received markdown from frontend (%d characters): %r",
+                len(generate_request.markdown_content),
+                generate_request.markdown_content[:200]
+            )
         
         # マークダウンが空の場合はサンプルを使用
         markdown_content = generate_request.markdown_content or SAMPLE_MARKDOWN
         
         # LLMでイシューを生成
-        issues = await generate_issues_from_markdown(markdown_content)
+        issues = await generate_issues_from_markdown(markdown_content, app.state.llm_semaphore)
+        
+        # 200文字を超える場合のみ切り詰めたプレビューを作る
+        preview = markdown_content if len(markdown_content) <= 200 else f"{markdown_content[:200]}..."
         
         return {
             "issues": issues,
-            "markdown_used": markdown_content[:200] + "..." if len(markdown_content) > 200 else markdown_content
+            "markdown_used": preview
         }
         
     except Exception as e:
-        print(f"Error generating issues: {e}")
+        logger.error("Error generating issues: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to generate issues"
         )
 
-@app.get("/api/llm/sample-markdown")
+@api_app.get("/llm/sample-markdown")
 async def get_sample_markdown():
     """サンプルマークダウンを取得"""
     return {"markdown": SAMPLE_MARKDOWN}
 
-@app.post("/api/auth/logout")
+@api_app.post("/auth/logout")
 async def logout():
     """ログアウト処理"""
     response = JSONResponse(content={"message": "Logged out successfully"})
     response.delete_cookie(key="access_token")
     return response
 
-# SPAのルーティング対応
-@app.get("/{full_path:path}", response_class=HTMLResponse)
-async def serve_spa(full_path: str):
-    """SPAのindex.htmlを返す"""
-    index_file = static_dir / "index.html" 
+# 起動時点のファイルシステムの状態（デバッグ用）
+DEBUG_SNAPSHOT = {
+    "static_dir_exists": static_dir.exists(),
+    "index_html_exists": INDEX_FILE.exists(),
+    "assets_dir_exists": (static_dir / "assets").exists(),
+    "current_directory": os.getcwd(),
+    "static_files": os.listdir(static_dir) if static_dir.exists() else []
+}
+
+@api_app.get("/debug")
+async def debug_info():
+    """デバッグ情報を返す（本番環境では無効）"""
+    if IS_PRODUCTION:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
     
-    if index_file.exists():
-        print(f"Serving index.html from: {index_file}")
-        with open(index_file, "r", encoding="utf-8") as f:
-            content = f.read()
-        return HTMLResponse(content=content)
-    else:
-        print(f"index.html not found at: {index_file}")
-        return HTMLResponse(content="""
+    return {
+        **DEBUG_SNAPSHOT,
+        "github_client_id_set": bool(os.getenv("GITHUB_CLIENT_ID")),
+        "openai_api_key_set": bool(os.getenv("OPENAI_API_KEY"))
+    }
+
+# フロントエンドのビルドが見つからない場合に返すHTML
+FALLBACK_HTML = HTMLResponse(content="""
         <!DOCTYPE html>
         <html>
         <head>
@@ -271,20 +428,14 @@ async def serve_spa(full_path: str):
         </body>
         </html>
         """)
+
+# SPAのルーティング対応
+@app.get("/{full_path:path}", response_class=HTMLResponse)
+async def serve_spa(request: Request, full_path: str):
+    """SPAのindex.htmlを返す"""
+    if INDEX_HTML is None:
+        return FALLBACK_HTML
     
-@app.get("/api/debug")
-async def debug_info():
-    """デバッグ情報を返す"""
-    static_exists = os.path.exists("static")
-    index_exists = os.path.exists("static/index.html")
-    assets_exists = os.path.exists("static/assets")
-    
-    return {
-        "static_dir_exists": static_exists,
-        "index_html_exists": index_exists,
-        "assets_dir_exists": assets_exists,
-        "github_client_id_set": bool(os.getenv("GITHUB_CLIENT_ID")),
-        "openai_api_key_set": bool(os.getenv("OPENAI_API_KEY")),
-        "current_directory": os.getcwd(),
-        "static_files": os.listdir("static") if static_exists else []
-    }
\ No newline at end of file
+    if request.headers.get("if-none-match") == INDEX_HEADERS["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=INDEX_HEADERS)
+    return Response(content=INDEX_HTML, media_type="text/html", headers=INDEX_HEADERS)
@@ -6,4 +6,4 @@ npm run build
 echo "Starting production server..."
 cd ../backend
 source venv/bin/activate
-uvicorn main:app --host 0.0.0.0 --port 8000
\ No newline at end of file
+uvicorn main:app --host 0.0.0.0 --port 8000 --loop uvloop --http httptools
\ No newline at end of file
@@ -164,8 +164,39 @@ function App() {
         throw new Error("Failed to load repositories");
       }
 
-      const repos = await response.json();
-      setRepositories(repos);
+      // NDJSON（1行1リポジトリ）を受信しながら順次反映する
+      const reader = response.body!.getReader();
+      const decoder = new TextDecoder();
+      const repos: Repository[] = [];
+      let buffer = "";
+      let completed = false;
+
+      while (true) {
+        const { done, value } = await reader.read();
+        buffer += decoder.decode(value, { stream: !done });
+
+        const lines = buffer.split("\n");
+        buffer = lines.pop() ?? "";
+        for (const line of lines) {
+          if (!line) continue;
+          const item = JSON.parse(line);
+          // 最終行は完了（done）またはエラー（error）を表す
+          if (item.error) throw new Error(item.error);
+          if (item.done) {
+            completed = true;
+            continue;
+          }
+          repos.push(item);
+        }
+        setRepositories([...repos]);
+
+        if (done) break;
+      }
+
+      // 完了行が届かなければ途中で切断されたとみなす
+      if (!completed) {
+        throw new Error("Repository stream ended unexpectedly");
+      }
     } catch (error) {
       setError("リポジトリの読み込みに失敗しました。再試行してください。");
       console.error("Failed to load repositories:", error);
@@ -392,40 +423,33 @@ function App() {
     const selectedIssuesList = Array.from(selectedIssues).map(
       (index) => generatedIssues[index]
     );
-    const successfulIssues: string[] = [];
-    const failedIssues: string[] = [];
 
     try {
-      const createPromises = selectedIssuesList.map(async (issue) => {
-        try {
-          const response = await fetch("/api/github/create-issue", {
-            method: "POST",
-            headers: {
-              "Content-Type": "application/json",
-            },
-            credentials: "include",
-            body: JSON.stringify({
-              repository: selectedRepo.full_name,
-              title: issue.title,
-              body: issue.body,
-              labels: issue.labels,
-            }),
-          });
-
-          if (!response.ok) {
-            throw new Error(`Failed to create issue: ${issue.title}`);
-          }
-
-          const result = await response.json();
-          successfulIssues.push(result.html_url);
-          return { success: true, issue, result };
-        } catch (error) {
-          failedIssues.push(issue.title);
-          return { success: false, issue, error };
-        }
+      const response = await fetch("/api/github/create-issues", {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+        },
+        credentials: "include",
+        body: JSON.stringify({
+          repository: selectedRepo.full_name,
+          issues: selectedIssuesList.map((issue) => ({
+            title: issue.title,
+            body: issue.body,
+            labels: issue.labels,
+          })),
+        }),
       });
 
-      await Promise.all(createPromises);
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+
+      const result = await response.json();
+      const successfulIssues: string[] = result.created.map(
+        (issue: { html_url: string }) => issue.html_url
+      );
+      const failedIssues: string[] = result.failed;
 
       if (successfulIssues.length > 0) {
         setError(